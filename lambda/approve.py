@@ -6,6 +6,7 @@ import logging
 from datetime import timedelta
 from botocore.exceptions import ClientError
 from botocore.config import Config
+from profiling import profile_handler
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -86,6 +87,7 @@ def deactivate_role(client,role_name):
     return deny_permission
 
 # Determine if any roles were used to make an AWS request
+@profile_handler
 def evaluate_role(client, member_account, role_name, role_last_used, max_days_for_last_used):
     role_inactive = False
 
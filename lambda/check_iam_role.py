@@ -6,19 +6,26 @@ import re
 import datetime
 import calendar
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import ClientError
 from botocore.config import Config
+from profiling import profile_handler, profile_task
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv('log_level', logging.INFO))
 
 # Configure boto retries
 BOTO_CONFIG = Config(retries=dict(max_attempts=5, mode='standard'))
+# Security Hub is shared by every account checked concurrently and has a low GetFindings quota, so its client
+# limits the request rate on the client side
+SECHUB_BOTO_CONFIG = Config(retries=dict(max_attempts=10, mode='adaptive'))
 ROLE_TIMEOUT_SECONDS = 900
 
 
+# The default boto3 session is not thread-safe, so each call uses its own session as accounts
+# from an SQS batch are checked concurrently
 def get_assume_role_credentials(account_id,cross_account_role):
-    sts_client = boto3.client('sts')
+    sts_client = boto3.session.Session().client('sts')
     try: 
         assume_role_response = sts_client.assume_role(RoleArn="arn:aws:iam::{}:role/{}".format(account_id,cross_account_role),
                                                         RoleSessionName=cross_account_role,
@@ -40,7 +47,7 @@ def get_client(service, account_id,cross_account_role):
     SECRET_KEY = temp_access['SecretAccessKey']
     SESSION_TOKEN = temp_access['SessionToken']
 
-    return boto3.client(
+    return boto3.session.Session().client(
                     service,
                     aws_access_key_id=ACCESS_KEY,
                     aws_secret_access_key=SECRET_KEY,
@@ -165,31 +172,17 @@ def get_role_authorization_details(iam_client):
     return roles_authorization_details
 
 
-# Check the compliance of each role by determining if role last used is > than max_days_for_last_used
-def lambda_handler(event, context):
-    sec_account_id = context.invoked_function_arn.split(":")[4]
-    member_account = ""
-    notification_creation_time = ""
+# Check the compliance of each role in member_account by determining if role last used is > than max_days_for_last_used
+def check_account(sec_account_id, member_account, notification_creation_time, sechub_client, stepfunc_client):
     role_owner = ""
     #retrieve State Machine Arn
     state_machine_arn = os.environ.get('state_machine_arn','')
 
-    # if the scope is aws account, retrieve the account number from env variables
-    if os.environ.get('member_account'):
-        member_account = os.environ.get('member_account')
-        notification_creation_time = str(event['time'])
-    else:
-    #if the scope is organization or OU, retrieve the account number from SNS message
-        member_account = event['Records'][0]['Sns']['Message']
-        notification_creation_time = str(event['Records'][0]['Sns']['Timestamp'])
-
     #retrieve the cross account role name from env variable cross_account_role
     cross_account_role = os.environ.get('cross_account_role')
 
     # Initialize  AWS clients 
     iam_client = get_client('iam', member_account,cross_account_role)
-    sechub_client = boto3.client('securityhub')
-    stepfunc_client = boto3.client('stepfunctions')
 
     # List of findings generated from resource evaluations to return back to AWS Security Hub
     non_compliance_findings = []
@@ -231,20 +224,88 @@ def lambda_handler(event, context):
         
         if new_finding is not None:
             non_compliance_findings.append(new_finding)
-            #need to reduce role name length to fit with state machine start_execution syntax 
-            #require 'name' to be less than 80 char long
-            if len(role_name) > 56:
-                role_name = role_name[0:55]
-            stepfunc_client.start_execution(
-                stateMachineArn=state_machine_arn,
-                name=member_account+"-"+role_name+"-"+str(calendar.timegm(datetime.datetime.now().utctimetuple())),
-                input=json.dumps(new_finding)
-                )
+            start_approval_execution(stepfunc_client, state_machine_arn, member_account, role_name, notification_creation_time, new_finding)
 
     # Iterate over our findings 100 at a time, as batch_import_findings only accepts a max of 100 evals.
     non_compliance_findings_copy = non_compliance_findings[:]
     
     while non_compliance_findings_copy:
-        sechub_client.batch_import_findings(Findings=non_compliance_findings_copy[:100])
+        import_findings = sechub_client.batch_import_findings(Findings=non_compliance_findings_copy[:100])
+        if import_findings['FailedCount']:
+            # Fail the account so it is checked again, approval workflows already started are not started twice
+            raise RuntimeError("Failed to import {} findings for account {}: {}".format(import_findings['FailedCount'], member_account, import_findings['FailedFindings']))
         del non_compliance_findings_copy[:100]
 
+
+# Start the approval workflow of a role. The execution name is built from notification_creation_time, which stays the same
+# when the same account notification is delivered again, so checking an account twice does not start a second workflow.
+# StartExecution with an existing name and the same input is a no-op, with a different input it raises ExecutionAlreadyExists.
+def start_approval_execution(stepfunc_client, state_machine_arn, member_account, role_name, notification_creation_time, finding):
+    # notification_creation_time is an ISO 8601 timestamp, with or without fractional seconds
+    notification_time = datetime.datetime.strptime(notification_creation_time[:19], '%Y-%m-%dT%H:%M:%S')
+
+    #need to reduce role name length to fit with state machine start_execution syntax 
+    #require 'name' to be less than 80 char long
+    if len(role_name) > 56:
+        role_name = role_name[0:55]
+    try:
+        stepfunc_client.start_execution(
+            stateMachineArn=state_machine_arn,
+            name=member_account+"-"+role_name+"-"+str(calendar.timegm(notification_time.utctimetuple())),
+            input=json.dumps(finding)
+            )
+    except ClientError as ex:
+        if 'ExecutionAlreadyExists' not in ex.response['Error']['Code']:
+            raise ex
+        logger.info("Approval workflow for role {} in account {} is already started".format(role_name, member_account))
+
+
+# Process a batch of account IDs received from the SQS work queue. Accounts in the batch are checked concurrently,
+# capped at max_workers threads, and failed accounts are reported back so that only those messages are redelivered.
+# More info here: https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html#services-sqs-batchfailurereporting
+def process_account_batch(sec_account_id, records, sechub_client, stepfunc_client):
+    max_workers = int(os.environ.get('max_workers', '5'))
+    batch_item_failures = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for record in records:
+            member_account = record['body']
+            # SentTimestamp is in epoch milliseconds, Security Hub expects an ISO 8601 timestamp
+            sent_timestamp = int(record['attributes']['SentTimestamp']) / 1000
+            notification_creation_time = datetime.datetime.utcfromtimestamp(sent_timestamp).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            future = executor.submit(profile_task(check_account), sec_account_id, member_account, notification_creation_time, sechub_client, stepfunc_client)
+            futures[future] = record
+
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                future.result()
+            except Exception as ex:
+                logger.error("Failed to check IAM roles in account {}: {}".format(record['body'], ex))
+                batch_item_failures.append({'itemIdentifier': record['messageId']})
+
+    return {'batchItemFailures': batch_item_failures}
+
+
+@profile_handler
+def lambda_handler(event, context):
+    sec_account_id = context.invoked_function_arn.split(":")[4]
+
+    # Initialize  AWS clients shared by every account checked in this invocation
+    sechub_client = boto3.client('securityhub', config=SECHUB_BOTO_CONFIG)
+    stepfunc_client = boto3.client('stepfunctions', config=BOTO_CONFIG)
+
+    # if the scope is aws account, retrieve the account number from env variables
+    if os.environ.get('member_account'):
+        member_account = os.environ.get('member_account')
+        notification_creation_time = str(event['time'])
+    #if the scope is organization or OU and accounts are queued in SQS, check the batch of accounts
+    elif event['Records'][0].get('eventSource') == 'aws:sqs':
+        return process_account_batch(sec_account_id, event['Records'], sechub_client, stepfunc_client)
+    else:
+    #if the scope is organization or OU, retrieve the account number from SNS message
+        member_account = event['Records'][0]['Sns']['Message']
+        notification_creation_time = str(event['Records'][0]['Sns']['Timestamp'])
+
+    check_account(sec_account_id, member_account, notification_creation_time, sechub_client, stepfunc_client)
@@ -1,5 +1,6 @@
 import boto3
 import os
+import time
 import logging
 from botocore.config import Config
 
@@ -9,11 +10,58 @@ logger.setLevel(os.getenv('log_level', logging.INFO))
 # Configure boto retries
 BOTO_CONFIG = Config(retries=dict(max_attempts=5, mode='standard'))
 
-sns_topic = os.environ['SNS_topic']
+sns_topic = os.environ.get('SNS_topic')
+sqs_queue_url = os.environ.get('SQS_queue_url')
 scope = os.environ.get('Scope')
 
 org_client = boto3.client('organizations')
 sns_client = boto3.client('sns')
+sqs_client = boto3.client('sqs', config=BOTO_CONFIG)
+
+# send_message_batch accepts a maximum of 10 messages per call
+SQS_BATCH_SIZE = 10
+# Number of times accounts that failed to be queued are sent again before giving up
+SQS_SEND_ATTEMPTS = 3
+
+
+# Queue a batch of account IDs, sending again only the entries SQS reports as failed so that
+# accounts already queued are not checked twice
+def send_sqs_batch(account_ids):
+    entries = [{'Id': account_id, 'MessageBody': account_id} for account_id in account_ids]
+
+    for attempt in range(SQS_SEND_ATTEMPTS):
+        send_sqs_messages = sqs_client.send_message_batch(
+            QueueUrl=sqs_queue_url,
+            Entries=entries
+            )
+        failed_ids = [item['Id'] for item in send_sqs_messages.get('Failed', [])]
+        if not failed_ids:
+            return
+        logger.info('Failed to queue accounts {}, attempt {} of {}'.format(failed_ids, attempt + 1, SQS_SEND_ATTEMPTS))
+        entries = [entry for entry in entries if entry['Id'] in failed_ids]
+        if attempt + 1 < SQS_SEND_ATTEMPTS:
+            time.sleep(2 ** attempt)
+
+    raise RuntimeError('Failed to queue accounts {}'.format(failed_ids))
+
+
+# Publish active account IDs to the SQS work queue when it is configured, otherwise one SNS message per account
+def send_accounts(list_aws_accounts):
+    account_ids = [account['Id'] for account in list_aws_accounts if account['Status'] == 'ACTIVE']
+
+    if not sqs_queue_url:
+        for account_id in account_ids:
+            send_sns_message = sns_client.publish(
+            TopicArn=sns_topic,
+            Message=account_id
+            )
+        logger.info('Send all account numbers to SNS topic')
+        return
+
+    while account_ids:
+        send_sqs_batch(account_ids[:SQS_BATCH_SIZE])
+        del account_ids[:SQS_BATCH_SIZE]
+    logger.info('Send all account numbers to SQS queue')
 
 def lambda_handler(event, context):
 
@@ -28,12 +76,7 @@ def lambda_handler(event, context):
             aws_accounts = org_client.list_accounts(NextToken=aws_accounts['NextToken'])
             list_aws_accounts.extend(aws_accounts['Accounts'])
             
-        for account in list_aws_accounts:
-            if account['Status'] == 'ACTIVE':
-                send_sns_message = sns_client.publish(
-                TopicArn=sns_topic,
-                Message=account['Id']
-                )
+        send_accounts(list_aws_accounts)
 
     if scope == 'OrganizationalUnit':
         ou_id = os.environ.get('OrganizationalUnitId')
@@ -50,10 +93,4 @@ def lambda_handler(event, context):
             aws_accounts = org_client.list_accounts_for_parent(NextToken=aws_accounts['NextToken'])
             list_aws_accounts.extend(aws_accounts['Accounts'])
 
-        for account in list_aws_accounts:
-            if account['Status'] == 'ACTIVE':
-                send_sns_message = sns_client.publish(
-                TopicArn=sns_topic,
-                Message=account['Id']
-                )
-    logger.info('Send all account numbers to SNS topic ')
\ No newline at end of file
+        send_accounts(list_aws_accounts)
\ No newline at end of file
@@ -0,0 +1,132 @@
+import boto3
+import cProfile
+import functools
+import io
+import os
+import pstats
+import time
+import threading
+import tracemalloc
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(os.getenv('log_level', logging.INFO))
+
+# Profiling is switched on with the env variable profiling=on. The profile is written to profile_output,
+# either a local directory (default /tmp) or an S3 location such as s3://bucket/prefix
+PROFILING_ENABLED = os.environ.get('profiling', 'off').lower() in ('on', 'true', '1')
+PROFILE_OUTPUT = os.environ.get('profile_output', '/tmp')
+DEFAULT_PROFILE_TOP_N = 20
+
+# Profiles of tasks run on worker threads during the current handler invocation, see profile_task
+task_profiles = []
+task_profiles_lock = threading.Lock()
+
+
+# Number of functions and allocation sites to log, read only when profiling is enabled so that
+# a bad value never breaks the handlers
+def get_profile_top_n():
+    try:
+        return int(os.environ.get('profile_top_n', DEFAULT_PROFILE_TOP_N))
+    except ValueError:
+        logger.info("Invalid profile_top_n, using {}".format(DEFAULT_PROFILE_TOP_N))
+        return DEFAULT_PROFILE_TOP_N
+
+
+def write_profile(stats, name):
+    file_name = "{}-{}.prof".format(name, int(time.time() * 1000))
+
+    if not PROFILE_OUTPUT.startswith('s3://'):
+        os.makedirs(PROFILE_OUTPUT, exist_ok=True)
+        local_path = os.path.join(PROFILE_OUTPUT, file_name)
+        stats.dump_stats(local_path)
+        return local_path
+
+    # Dump to /tmp first, as it is the only writable path in Lambda, then upload to S3
+    local_path = os.path.join('/tmp', file_name)
+    stats.dump_stats(local_path)
+    bucket, _, prefix = PROFILE_OUTPUT[len('s3://'):].partition('/')
+    key = prefix.rstrip('/') + '/' + file_name if prefix else file_name
+    try:
+        boto3.client('s3').upload_file(local_path, bucket, key)
+    finally:
+        os.remove(local_path)
+    return "s3://{}/{}".format(bucket, key)
+
+
+def log_summary(stats, snapshot, name, top_n):
+    stats_output = io.StringIO()
+    stats.stream = stats_output
+    stats.sort_stats('cumulative').print_stats(top_n)
+    logger.info("Top {} functions by cumulative time in {}:\n{}".format(top_n, name, stats_output.getvalue()))
+
+    allocation_sites = "\n".join(str(stat) for stat in snapshot.statistics('lineno')[:top_n])
+    logger.info("Top {} allocation sites in {}:\n{}".format(top_n, name, allocation_sites))
+
+
+# Wrap func, run on a worker thread, with its own cProfile profiler when profiling is enabled. cProfile only
+# records the thread that enables it, so the profiles are collected and merged into the profile of the
+# enclosing handler wrapped with profile_handler.
+def profile_task(func):
+    if not PROFILING_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except Exception as ex:
+            # Never fail the task because it could not be profiled, e.g. Python 3.12 and later only
+            # allow one active profiler while the handler is being profiled
+            logger.error("Failed to profile {}: {}".format(func.__qualname__, ex))
+            return func(*args, **kwargs)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with task_profiles_lock:
+                task_profiles.append(profiler)
+
+    return wrapper
+
+
+# Wrap func with cProfile and tracemalloc when profiling is enabled. When it is disabled, func is returned
+# unchanged so the decorator adds no overhead to the handler.
+def profile_handler(func):
+    if not PROFILING_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        name = "{}.{}".format(func.__module__, func.__qualname__)
+        top_n = get_profile_top_n()
+        profiler = cProfile.Profile()
+        tracemalloc_started = not tracemalloc.is_tracing()
+        if tracemalloc_started:
+            tracemalloc.start()
+        with task_profiles_lock:
+            del task_profiles[:]
+
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            if tracemalloc_started:
+                tracemalloc.stop()
+            try:
+                stats = pstats.Stats(profiler)
+                with task_profiles_lock:
+                    for task_profiler in task_profiles:
+                        stats.add(task_profiler)
+                    del task_profiles[:]
+                log_summary(stats, snapshot, name, top_n)
+                logger.info("Profile of {} written to {}".format(name, write_profile(stats, name)))
+            except Exception as ex:
+                # Never fail the handler because the profile could not be saved
+                logger.error("Failed to write profile of {}: {}".format(name, ex))
+
+    return wrapper
@@ -5,6 +5,7 @@ import datetime
 import logging
 from botocore.exceptions import ClientError
 from botocore.config import Config
+from profiling import profile_handler
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -131,6 +132,7 @@ def delete_role(client,role_name):
         return "Fail to delete IAM Role {}".format(role_name)
         
 # Determine if any roles were used to make an AWS request
+@profile_handler
 def validate_deletion(client, member_account, role_name, role_last_used, max_days_for_last_used):
     #add 30days wait time before deleting the role
 